@@ -1,23 +1,35 @@
 import os
+import asyncio
+import atexit
 import logging
+import queue
 import random
+import sqlite3
 from datetime import datetime, time, timedelta
-from typing import Optional, Dict, Any
+from time import time as unix_time
+from typing import Optional, Dict, Any, Deque
 import json
-from collections import defaultdict
-
-import pytz
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from zoneinfo import ZoneInfo
+
+import httpx
+from cachetools import LRUCache
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
-    Application, CommandHandler, ContextTypes,
+    AIORateLimiter, Application, CommandHandler, ContextTypes,
     CallbackQueryHandler, MessageHandler, filters
 )
 
 # Google Sheets импорты
+import httplib2
+from google.auth import exceptions as auth_exceptions
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from google_auth_httplib2 import Request as AuthRequest
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -26,24 +38,59 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 SPREADSHEET_ID = os.getenv("SPREADSHEET_ID")
 TIMEZONE = os.getenv("TIMEZONE", "Europe/Moscow")
+TZ = ZoneInfo(TIMEZONE)
 CREDENTIALS_FILE = "credentials.json"
+USERS_DB = os.getenv("USERS_DB", "users.db")
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "256"))  # апдейтов в обработке одновременно
+STATS_CACHE_SIZE = 1000  # сколько статистик держать в памяти, остальные - только в базе
+SHEETS_FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", "5"))  # секунды между отправками
+SHEETS_SCOPES = ("https://www.googleapis.com/auth/spreadsheets",)
+SHEETS_APPEND_URL = "https://sheets.googleapis.com/v4/spreadsheets/{spreadsheet_id}/values/{range}:append"
+SHEETS_MAX_BATCH = 100  # максимум строк в одном запросе к Google Sheets
+SHEETS_MAX_QUEUE = 10000  # предел очереди, чтобы долгий простой Sheets не съел память
+# Массовые малополезные события пишем в таблицу 1 раз из N (остальные - 1 из 1)
+SHEETS_SAMPLE_RATES = {"REMINDER_SENT": 10}
+SHEETS_TIMEOUT = 5  # секунды на HTTP-запрос к Google
+# Сколько держать простаивающее соединение с Google: больше интервала отправки,
+# чтобы каждая пачка не начиналась с нового TLS-рукопожатия
+SHEETS_KEEPALIVE = max(60.0, SHEETS_FLUSH_INTERVAL * 2)
+SHEETS_ERROR_LOG_INTERVAL = 60  # не чаще одного сообщения об ошибке Sheets в минуту
+
+# Расписание напоминаний: ПН, СР, ПТ в 17:00 (в PTB 20 дни считаются с ВС=0: ПН=1, СР=3, ПТ=5)
+TARGET_DAYS = (1, 3, 5)
+REMINDER_TIME = time(hour=17, minute=0, tzinfo=TZ)
+REMINDER_JOB_NAME = "forearm_reminder"
 
 # Хранилище данных пользователей
 user_chats: Dict[int, Dict[str, Any]] = {}
-user_stats: Dict[int, Dict[str, Any]] = defaultdict(lambda: {
-    "workouts_done": 0,
-    "total_hold_time": 0,
-    "max_hold_time": 0,
-    "pullups_done": 0,
-    "current_streak": 0,
-    "last_workout": None,
-    "achievements": []
-})
+
+
+@dataclass(slots=True)
+class UserStats:
+    """Статистика тренировок пользователя"""
+    workouts_done: int = 0
+    total_hold_time: int = 0
+    max_hold_time: int = 0
+    pullups_done: int = 0
+    current_streak: int = 0
+    last_workout: Optional[datetime] = None
+    # Полученные (в порядке получения) и оставшиеся достижения: id -> описание.
+    # Словари вместо множеств, чтобы сохранялся порядок вывода
+    achievements: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    locked: Dict[str, Dict[str, str]] = field(default_factory=lambda: dict(ACHIEVEMENTS))
+
+
+# Статистика подгружается из базы по мере надобности (см. get_stats)
+user_stats: LRUCache = LRUCache(maxsize=STATS_CACHE_SIZE)
+STATS_COLUMNS = (
+    "workouts_done", "total_hold_time", "max_hold_time", "pullups_done",
+    "current_streak", "last_workout", "achievements"
+)
 
 # --- ПРИКОЛЮХИ ---
 
 # Мотивационные фразы
-MOTIVATION_PHRASES = [
+MOTIVATION_PHRASES = (
     "💪 Твои предплечья скажут тебе спасибо!",
     "🔥 Еще немного - и ты будешь крушить арбузы голыми руками!",
     "⚡ Каждая секунда виса делает тебя сильнее!",
@@ -54,10 +101,10 @@ MOTIVATION_PHRASES = [
     "🎸 Представь, как круто ты будешь играть на гитаре с такими предплечьями!",
     "💥 Прогресс не остановить!",
     "🏆 Сегодня ты лучше, чем вчера!"
-]
+)
 
 # Смешные комментарии после тренировки
-WORKOUT_COMMENTS = [
+WORKOUT_COMMENTS = (
     "Отлично! Теперь можно и арбуз голыми руками раздавить! 🍉",
     "Молодец! Твои предплечья становятся сильнее с каждой тренировкой! 💪",
     "Супер! После таких тренировок рукопожатие будет железным! 🤝",
@@ -66,7 +113,34 @@ WORKOUT_COMMENTS = [
     "Так держать! Скоро сможешь подтягиваться на мизинцах! 🖕",
     "Здорово! Ты сегодня победил свою лень! 🏆",
     "Круто! Твои предплечья теперь как канаты! ⛓️"
-]
+)
+
+# Все 11 вариантов прогресс-бара для статистики
+PROGRESS_BARS = tuple("█" * i + "░" * (10 - i) for i in range(11))
+
+# Результаты кнопок отметки тренировки: (время виса, подтягиваний за подход),
+# по умолчанию - средние 25 секунд и 6 подтягиваний
+WORKOUT_LOG_VALUES = {
+    "log_hold_25": (25, 6),
+    "log_hold_35": (35, 6),
+    "log_hold_45": (45, 6),
+    "log_pull_5": (25, 5),
+    "log_pull_7": (25, 7),
+    "log_pull_9": (25, 9),
+    "log_simple": (25, 6),
+}
+
+# Факты о предплечьях
+FACTS = (
+    "Знаешь ли ты, что сила хвата напрямую связана с долголетием? 🧬",
+    "Предплечья состоят из 20 мышц! Это целая мышцефабрика! 🏭",
+    "Рекорд виса на перекладине - 1 час 5 минут! 😱",
+    "Сильные предплечья помогают играть на музыкальных инструментах 🎸",
+    "У альпинистов самые сильные предплечья в мире 🧗",
+    "Каждый день наши руки совершают тысячи хватательных движений ✋",
+    "Мышцы предплечий восстанавливаются быстрее, чем бицепс или трицепс ⚡",
+    "Сильный хват привлекает противоположный пол (научно доказано!) 💘"
+)
 
 # Достижения
 ACHIEVEMENTS = {
@@ -79,113 +153,453 @@ ACHIEVEMENTS = {
     "pullup_king": {"name": "Король подтягиваний", "desc": "Сделал 100 подтягиваний", "emoji": "🤴"}
 }
 
+# Условия получения достижений (проверяются по порядку)
+ACHIEVEMENT_RULES = (
+    ("first_workout", lambda s: s.workouts_done == 1),
+    ("streak_3", lambda s: s.current_streak >= 3),
+    ("streak_10", lambda s: s.current_streak >= 10),
+    ("workouts_10", lambda s: s.workouts_done >= 10),
+    ("workouts_50", lambda s: s.workouts_done >= 50),
+    ("hold_60", lambda s: s.max_hold_time >= 60),
+    ("pullup_king", lambda s: s.pullups_done >= 100),
+)
+
+# --- ТЕКСТЫ ---
+# Неизменные части сообщений собираются один раз при запуске
+
+# Программа тренировки для кнопки "Сегодняшняя тренировка"
+WORKOUT_PROGRAM_TEXT = (
+    "📋 **Сегодняшняя программа:**\n\n"
+    "1️⃣ **Вис на перекладине**\n"
+    "   3 подхода по 20-30 секунд\n"
+    "   Хват: ладони от себя\n\n"
+    "2️⃣ **Подтягивания с паузой**\n"
+    "   3 подхода по 5-8 повторений\n"
+    "   Пауза в верхней точке 2 секунды\n\n"
+    "💡 **Совет дня:** Дыши ровно и концентрируйся на мышцах!"
+)
+
+# Краткая программа для команды /workout
+WORKOUT_COMMAND_TEXT = (
+    "📋 **Сегодняшняя программа:**\n\n"
+    "1️⃣ **Вис на перекладине**\n"
+    "   3 подхода по 20-30 секунд\n\n"
+    "2️⃣ **Подтягивания с паузой**\n"
+    "   3 подхода по 5-8 повторений\n\n"
+    "💪 У тебя получится!"
+)
+
+HELP_TEXT = (
+    "❓ **Как пользоваться ботом**\n\n"
+    "🤖 **Команды:**\n"
+    "/start - Главное меню\n"
+    "/workout - Тренировка на сегодня\n"
+    "/stats - Моя статистика\n"
+    "/achievements - Достижения\n"
+    "/fact - Случайный факт\n"
+    "/log - Отметить тренировку\n\n"
+    "📅 Напоминания приходят в ПН, СР, ПТ в 17:00\n\n"
+    "💪 **Совет:** После тренировки отмечай её в боте,\n"
+    "чтобы копились достижения и статистика!"
+)
+
+# --- КЛАВИАТУРЫ ---
+# Все клавиатуры статичные, поэтому собираются один раз при запуске
+
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📋 Сегодняшняя тренировка", callback_data="workout_today"),
+        InlineKeyboardButton("📊 Моя статистика", callback_data="stats")
+    ],
+    [
+        InlineKeyboardButton("🏆 Достижения", callback_data="achievements"),
+        InlineKeyboardButton("❓ Помощь", callback_data="help")
+    ],
+    [
+        InlineKeyboardButton("🎲 Случайный факт", callback_data="random_fact"),
+        InlineKeyboardButton("📝 Отметить тренировку", callback_data="log_workout")
+    ]
+])
+
+BACK_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]])
+
+TO_MENU_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 В меню", callback_data="back_to_menu")]])
+
+# Кнопка "Я сделал это!"
+WORKOUT_TODAY_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Я выполнил тренировку!", callback_data="log_workout")]
+])
+
+FACT_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🎲 Еще факт", callback_data="random_fact"),
+        InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")
+    ]
+])
+
+LOG_WORKOUT_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("20-30 сек", callback_data="log_hold_25"),
+        InlineKeyboardButton("30-40 сек", callback_data="log_hold_35"),
+        InlineKeyboardButton("40+ сек", callback_data="log_hold_45")
+    ],
+    [
+        InlineKeyboardButton("5-6 подтягиваний", callback_data="log_pull_5"),
+        InlineKeyboardButton("7-8 подтягиваний", callback_data="log_pull_7"),
+        InlineKeyboardButton("9+ подтягиваний", callback_data="log_pull_9")
+    ],
+    [
+        InlineKeyboardButton("✅ Отметить без деталей", callback_data="log_simple"),
+        InlineKeyboardButton("🔙 Отмена", callback_data="back_to_menu")
+    ]
+])
+
+# Кнопки под напоминанием
+REMINDER_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Отметить тренировку", callback_data="log_workout")],
+    [InlineKeyboardButton("📋 Показать тренировку", callback_data="workout_today")]
+])
+
 # --- НАСТРОЙКА ЛОГИРОВАНИЯ ---
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
+# Обработчики только кладут записи в очередь, а форматирование и вывод
+# выполняются в отдельном потоке и не задерживают event loop
+log_queue = queue.SimpleQueue()
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(
+    logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 )
+log_listener = QueueListener(log_queue, stream_handler)
+# basicConfig не подходит: он повесил бы на QueueHandler свой формат,
+# и сообщение форматировалось бы дважды
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(QueueHandler(log_queue))
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 
 # --- КЛАСС ДЛЯ РАБОТЫ С GOOGLE SHEETS ---
+
+def is_retryable(error: Exception) -> bool:
+    """Можно ли повторить запрос к Google (таймаут, сеть, 429, 5xx)"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TransportError, auth_exceptions.TransportError))
+
+
+@lru_cache(maxsize=4)
+def load_credentials(credentials_file: str, scopes: tuple):
+    """Чтение ключа сервисного аккаунта (JSON и RSA-ключ разбираются один раз)"""
+    return service_account.Credentials.from_service_account_file(
+        credentials_file,
+        scopes=list(scopes)
+    )
+
+
+# (секунда, отформатированная строка) последней метки времени
+_timestamp_cache = (0, "")
+
+
+def format_timestamp() -> str:
+    """Текущее время для логов, пересчитывается не чаще раза в секунду"""
+    global _timestamp_cache
+    second = int(unix_time())
+    if second != _timestamp_cache[0]:
+        _timestamp_cache = (
+            second,
+            # Без смещения зоны: тот же вид "ГГГГ-ММ-ДД ЧЧ:ММ:СС", что понимает Sheets
+            datetime.fromtimestamp(second, TZ).replace(tzinfo=None)
+            .isoformat(sep=" ", timespec="seconds")
+        )
+    return _timestamp_cache[1]
+
+
 class GoogleSheetsLogger:
     def __init__(self, credentials_file: str, spreadsheet_id: str):
         self.spreadsheet_id = spreadsheet_id
-        self.service = None
-        self._initialize_service(credentials_file)
-
-    def _initialize_service(self, credentials_file: str):
-        """Инициализация сервиса Google Sheets"""
+        self.range = "Logs!A:F"  # Добавили колонку F для дополнительных данных
+        self.value_input_option = "USER_ENTERED"
+        self.append_url = SHEETS_APPEND_URL.format(spreadsheet_id=spreadsheet_id, range=self.range)
+        self.credentials = None
+        self.event_counts = Counter()  # точное число событий, включая не попавшие в выборку
+        self._queue: Deque[list] = deque()
+        self._wakeup = asyncio.Event()  # досрочная отправка: набралась пачка или остановка
+        self._closing = False
+        self._flusher_task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._last_error_logged = 0.0
+        self._dropped_rows = 0  # потеряно строк с последнего сообщения об ошибке
+        self._retry_at = 0.0  # до этого момента после временного сбоя Sheets не трогаем
+        # Запись идет асинхронно через httpx, а в отдельном потоке - только
+        # блокирующее обновление токена (раз в час)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheets")
+        self._auth_request = AuthRequest(httplib2.Http(timeout=SHEETS_TIMEOUT))
+        self._initialize_credentials(credentials_file)
+
+    def _initialize_credentials(self, credentials_file: str):
+        """Загрузка ключа сервисного аккаунта для Google Sheets"""
         try:
-            credentials = service_account.Credentials.from_service_account_file(
-                credentials_file,
-                scopes=["https://www.googleapis.com/auth/spreadsheets"]
-            )
-            self.service = build("sheets", "v4", credentials=credentials)
-            logger.info("✅ Подключение к Google Sheets установлено")
+            self.credentials = load_credentials(credentials_file, SHEETS_SCOPES)
+            logger.info("✅ Подключение к Google Sheets настроено")
         except Exception as e:
-            logger.error(f"❌ Ошибка подключения к Google Sheets: {e}")
+            logger.error("❌ Ошибка подключения к Google Sheets: %s", e)
 
     def log_event(self, event_type: str, chat_id: Optional[int] = None,
                   username: Optional[str] = None, message: str = "",
                   additional_data: str = ""):
-        """Запись события в Google Sheets"""
-        if not self.service:
+        """Постановка события в очередь на запись в Google Sheets"""
+        self.event_counts[event_type] += 1
+
+        if not self.credentials:
             return
 
-        try:
-            tz = pytz.timezone(TIMEZONE)
-            timestamp = datetime.now(tz).strftime("%Y-%m-%d %H:%M:%S")
-
-            values = [[
-                timestamp,
-                event_type,
-                str(chat_id) if chat_id else "",
-                username or "",
-                message,
-                additional_data
-            ]]
-
-            body = {"values": values}
-
-            self.service.spreadsheets().values().append(
-                spreadsheetId=self.spreadsheet_id,
-                range="Logs!A:F",  # Добавили колонку F для дополнительных данных
-                valueInputOption="USER_ENTERED",
-                body=body
-            ).execute()
+        if random.randrange(SHEETS_SAMPLE_RATES.get(event_type, 1)):
+            return
 
-        except Exception as e:
-            logger.error(f"❌ Ошибка записи в Google Sheets: {e}")
+        if len(self._queue) >= SHEETS_MAX_QUEUE:
+            self._dropped_rows += 1
+            return
+
+        self._queue.append([
+            format_timestamp(),
+            event_type,
+            chat_id if chat_id is not None else "",
+            username or "",
+            message,
+            additional_data
+        ])
+
+        # Во время паузы после сбоя очередь полна из-за возвращенных строк,
+        # будить отправку по размеру пачки в это время нельзя
+        if len(self._queue) >= SHEETS_MAX_BATCH and unix_time() >= self._retry_at:
+            self._wakeup.set()
+
+    def start_flusher(self):
+        """Запуск фоновой отправки событий (нужен работающий event loop)"""
+        if self.credentials and not self._flusher_task:
+            # Пачки уходят строго по одной, так что хватает одного соединения
+            self._client = httpx.AsyncClient(
+                timeout=SHEETS_TIMEOUT,
+                limits=httpx.Limits(max_keepalive_connections=1, keepalive_expiry=SHEETS_KEEPALIVE)
+            )
+            self._flusher_task = asyncio.create_task(self._flusher())
+
+    async def stop_flusher(self):
+        """Остановка фоновой отправки с дозаписью оставшихся событий"""
+        self._closing = True
+        self._wakeup.set()
+        if self._flusher_task:
+            await self._flusher_task
+            self._flusher_task = None
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+        # Точные счетчики, в том числе событий, не попавших в таблицу из-за выборки
+        logger.info("📊 События за время работы: %s", dict(self.event_counts))
+        # Что не удалось дозаписать из-за сбоя, при остановке уже потеряно
+        self._dropped_rows += len(self._queue)
+        self._queue.clear()
+        if self._dropped_rows:
+            logger.error("❌ Не записано в Google Sheets строк: %d", self._dropped_rows)
+        self._executor.shutdown(wait=True)
+
+    async def _flusher(self):
+        """Отправляет накопленные события раз в SHEETS_FLUSH_INTERVAL или по полной пачке"""
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), SHEETS_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._closing and unix_time() < self._retry_at:
+                continue
+            await self.flush()
+
+    async def flush(self):
+        """Запись всех накопленных событий, до SHEETS_MAX_BATCH строк за запрос"""
+        loop = asyncio.get_running_loop()
+
+        while self._queue:
+            rows = [self._queue.popleft()
+                    for _ in range(min(len(self._queue), SHEETS_MAX_BATCH))]
+
+            try:
+                if not self.credentials.valid:
+                    await loop.run_in_executor(
+                        self._executor, self.credentials.refresh, self._auth_request
+                    )
+
+                headers = {}
+                self.credentials.apply(headers)
+                response = await self._client.post(
+                    self.append_url,
+                    params={"valueInputOption": self.value_input_option},
+                    json={"values": rows},
+                    headers=headers
+                )
+                response.raise_for_status()
+            except Exception as e:
+                if is_retryable(e):
+                    # Временный сбой: возвращаем строки в начало очереди
+                    # и пробуем снова не раньше чем через SHEETS_FLUSH_INTERVAL
+                    self._queue.extendleft(reversed(rows))
+                    self._retry_at = unix_time() + SHEETS_FLUSH_INTERVAL
+                    self._report_error(e)
+                    return
+                self._dropped_rows += len(rows)
+                self._report_error(e)
+
+    def _report_error(self, error: Exception):
+        """Сообщение об ошибке записи, не чаще раза в SHEETS_ERROR_LOG_INTERVAL"""
+        # Если Sheets лежит долго, не засоряем лог одной и той же ошибкой,
+        # но число потерянных за это время строк не скрываем
+        now = unix_time()
+        if now - self._last_error_logged >= SHEETS_ERROR_LOG_INTERVAL:
+            self._last_error_logged = now
+            logger.error("❌ Ошибка записи в Google Sheets: %s (потеряно строк: %d)",
+                         error, self._dropped_rows)
+            self._dropped_rows = 0
 
 
 # Создаем логгер
 try:
     sheets_logger = GoogleSheetsLogger(CREDENTIALS_FILE, SPREADSHEET_ID)
 except Exception as e:
-    logger.error(f"Не удалось создать логгер Google Sheets: {e}")
+    logger.error("Не удалось создать логгер Google Sheets: %s", e)
     sheets_logger = None
 
 
-# --- ФУНКЦИИ ДЛЯ РАБОТЫ С ДОСТИЖЕНИЯМИ ---
+# --- ХРАНИЛИЩЕ ПОЛЬЗОВАТЕЛЕЙ И СТАТИСТИКИ ---
 
-def check_achievements(chat_id: int, workout_data: dict):
-    """Проверка и выдача достижений"""
-    stats = user_stats[chat_id]
-    new_achievements = []
+def open_users_db(path: str) -> sqlite3.Connection:
+    """Открытие базы пользователей (таблицы создаются при первом запуске)"""
+    # Соединением пользуется только поток db_executor (и main() до запуска бота)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS users ("
+        "chat_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, registered_at TEXT)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS stats ("
+        "chat_id INTEGER PRIMARY KEY, workouts_done INTEGER, total_hold_time INTEGER, "
+        "max_hold_time INTEGER, pullups_done INTEGER, current_streak INTEGER, "
+        "last_workout TEXT, achievements TEXT)"
+    )
+    conn.commit()
+    return conn
+
+
+users_db = open_users_db(USERS_DB)
+# Запросы к базе - дисковый ввод-вывод, поэтому из обработчиков они идут
+# через отдельный поток и не блокируют event loop
+db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+
+async def run_db(func, *args):
+    """Выполнение функции работы с базой в потоке db_executor"""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, func, *args)
+
+
+def load_users():
+    """Загрузка сохраненных пользователей, чтобы после рестарта не ждать /start"""
+    rows = users_db.execute("SELECT chat_id, username, first_name, registered_at FROM users")
+    for chat_id, username, first_name, registered_at in rows:
+        user_chats[chat_id] = {
+            "username": username,
+            "first_name": first_name,
+            "registered_at": registered_at
+        }
+    logger.info("✅ Загружено пользователей: %d", len(user_chats))
+
+
+def write_user(row: tuple):
+    """Запись строки пользователя в базу (выполняется в db_executor)"""
+    with users_db:
+        users_db.execute(
+            # Повторный /start обновляет имя, но не дату регистрации
+            "INSERT INTO users (chat_id, username, first_name, registered_at) "
+            "VALUES (?, ?, ?, ?) ON CONFLICT(chat_id) DO UPDATE SET "
+            "username = excluded.username, first_name = excluded.first_name",
+            row
+        )
+
+
+async def save_user(chat_id: int):
+    """Сохранение пользователя из user_chats в базу"""
+    profile = user_chats[chat_id]
+    await run_db(write_user, (chat_id, profile["username"], profile["first_name"],
+                              profile["registered_at"]))
 
-    # Первая тренировка
-    if stats["workouts_done"] == 1 and "first_workout" not in stats["achievements"]:
-        stats["achievements"].append("first_workout")
-        new_achievements.append(ACHIEVEMENTS["first_workout"])
 
-    # Серии тренировок
-    if stats["current_streak"] >= 3 and "streak_3" not in stats["achievements"]:
-        stats["achievements"].append("streak_3")
-        new_achievements.append(ACHIEVEMENTS["streak_3"])
+def read_stats(chat_id: int) -> Optional[tuple]:
+    """Чтение строки статистики из базы (выполняется в db_executor)"""
+    return users_db.execute(
+        f"SELECT {', '.join(STATS_COLUMNS)} FROM stats WHERE chat_id = ?", (chat_id,)
+    ).fetchone()
 
-    if stats["current_streak"] >= 10 and "streak_10" not in stats["achievements"]:
-        stats["achievements"].append("streak_10")
-        new_achievements.append(ACHIEVEMENTS["streak_10"])
 
-    # Общее количество тренировок
-    if stats["workouts_done"] >= 10 and "workouts_10" not in stats["achievements"]:
-        stats["achievements"].append("workouts_10")
-        new_achievements.append(ACHIEVEMENTS["workouts_10"])
+def write_stats(row: tuple):
+    """Запись строки статистики в базу (выполняется в db_executor)"""
+    with users_db:
+        users_db.execute(
+            f"INSERT OR REPLACE INTO stats (chat_id, {', '.join(STATS_COLUMNS)}) "
+            f"VALUES (?{', ?' * len(STATS_COLUMNS)})",
+            row
+        )
+
+
+async def get_stats(chat_id: int) -> UserStats:
+    """Статистика пользователя: из кэша, из базы или новая"""
+    stats = user_stats.get(chat_id)
+    if stats is not None:
+        return stats
+
+    row = await run_db(read_stats, chat_id)
+    if row:
+        # В базе дата и достижения хранятся строками, разбираем их один раз
+        *counters, last_workout, earned_ids = row
+        achievements = {ach_id: ACHIEVEMENTS[ach_id]
+                        for ach_id in earned_ids.split(",") if ach_id in ACHIEVEMENTS}
+        stats = UserStats(
+            *counters,
+            last_workout=datetime.fromisoformat(last_workout) if last_workout else None,
+            achievements=achievements,
+            locked={ach_id: ach for ach_id, ach in ACHIEVEMENTS.items()
+                    if ach_id not in achievements}
+        )
+    else:
+        stats = UserStats()
+
+    # Пока шел запрос, статистику мог загрузить параллельный апдейт того же чата
+    cached = user_stats.get(chat_id)
+    if cached is not None:
+        return cached
+    user_stats[chat_id] = stats
+    return stats
 
-    if stats["workouts_done"] >= 50 and "workouts_50" not in stats["achievements"]:
-        stats["achievements"].append("workouts_50")
-        new_achievements.append(ACHIEVEMENTS["workouts_50"])
 
-    # Время виса
-    if stats["max_hold_time"] >= 60 and "hold_60" not in stats["achievements"]:
-        stats["achievements"].append("hold_60")
-        new_achievements.append(ACHIEVEMENTS["hold_60"])
+async def save_stats(chat_id: int, stats: UserStats):
+    """Сохранение статистики пользователя в базу"""
+    # Строка собирается до передачи в поток, поэтому пишется ровно текущее состояние
+    values = [getattr(stats, column) for column in STATS_COLUMNS]
+    values[-2] = stats.last_workout.isoformat() if stats.last_workout else None
+    values[-1] = ",".join(stats.achievements)
+    await run_db(write_stats, (chat_id, *values))
 
-    # Подтягивания
-    if stats["pullups_done"] >= 100 and "pullup_king" not in stats["achievements"]:
-        stats["achievements"].append("pullup_king")
-        new_achievements.append(ACHIEVEMENTS["pullup_king"])
+
+# --- ФУНКЦИИ ДЛЯ РАБОТЫ С ДОСТИЖЕНИЯМИ ---
+
+def check_achievements(stats: UserStats, workout_data: dict):
+    """Проверка и выдача достижений"""
+    new_achievements = []
+
+    for ach_id, condition in ACHIEVEMENT_RULES:
+        if ach_id in stats.locked and condition(stats):
+            ach = stats.locked.pop(ach_id)
+            stats.achievements[ach_id] = ach
+            new_achievements.append(ach)
 
     return new_achievements
 
@@ -198,31 +612,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.effective_user.username or "NoUsername"
     first_name = update.effective_user.first_name
 
-    # Сохраняем пользователя
+    # Сохраняем пользователя (у вернувшегося остается прежняя дата регистрации)
+    profile = user_chats.get(chat_id)
     user_chats[chat_id] = {
         "username": username,
         "first_name": first_name,
-        "registered_at": datetime.now(pytz.timezone(TIMEZONE)).isoformat()
+        "registered_at": profile["registered_at"] if profile else datetime.now(TZ).isoformat()
     }
 
-    # Создаем красивое меню с кнопками
-    keyboard = [
-        [
-            InlineKeyboardButton("📋 Сегодняшняя тренировка", callback_data="workout_today"),
-            InlineKeyboardButton("📊 Моя статистика", callback_data="stats")
-        ],
-        [
-            InlineKeyboardButton("🏆 Достижения", callback_data="achievements"),
-            InlineKeyboardButton("❓ Помощь", callback_data="help")
-        ],
-        [
-            InlineKeyboardButton("🎲 Случайный факт", callback_data="random_fact"),
-            InlineKeyboardButton("📝 Отметить тренировку", callback_data="log_workout")
-        ]
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     # Приветственное сообщение
     welcome_text = (
         f"🌟 Привет, {first_name}! 🌟\n\n"
@@ -232,7 +629,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "👇 Выбери, что хочешь сделать:"
     )
 
-    await update.message.reply_text(welcome_text, reply_markup=reply_markup)
+    await update.message.reply_text(welcome_text, reply_markup=MAIN_MENU_MARKUP)
+
+    # Запись на диск и в лог уже после ответа, чтобы пользователь ее не ждал
+    await save_user(chat_id)
 
     if sheets_logger:
         sheets_logger.log_event(
@@ -242,8 +642,18 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             message=f"Пользователь {first_name} запустил бота"
         )
 
-    # Запускаем расписание
-    await schedule_reminders_for_user(context.application, chat_id)
+
+async def edit_message(query, context, text: str, reply_markup: InlineKeyboardMarkup,
+                       parse_mode: Optional[str] = None):
+    """Замена текста сообщения с кнопками (если он не изменился - без запроса)"""
+    # Telegram все равно отклонит такую правку ("message is not modified"),
+    # но запрос потратит лимит бота. Клавиатуры - константы, сравниваем по id
+    render = (query.message.message_id, text, parse_mode, id(reply_markup))
+    if context.chat_data.get("last_render") == render:
+        return
+
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    context.chat_data["last_render"] = render
 
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -254,234 +664,129 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     callback_data = query.data
 
-    if callback_data == "workout_today":
-        await show_todays_workout(query, chat_id)
-    elif callback_data == "stats":
-        await show_stats(query, chat_id)
-    elif callback_data == "achievements":
-        await show_achievements(query, chat_id)
-    elif callback_data == "help":
-        await show_help(query)
-    elif callback_data == "random_fact":
-        await send_random_fact(query)
-    elif callback_data == "log_workout":
-        await ask_workout_details(query, context, chat_id)
-    elif callback_data.startswith("log_"):
+    handler = CALLBACK_HANDLERS.get(callback_data)
+    if handler:
+        await handler(query, context, chat_id)
+    elif callback_data in WORKOUT_LOG_VALUES:
         await process_workout_log(query, context, chat_id, callback_data)
 
 
-async def show_todays_workout(query, chat_id):
+async def show_todays_workout(query, context, chat_id):
     """Показать тренировку на сегодня"""
-    # Случайная мотивация
-    motivation = random.choice(MOTIVATION_PHRASES)
-
-    workout_text = (
-        f"{motivation}\n\n"
-        "📋 **Сегодняшняя программа:**\n\n"
-        "1️⃣ **Вис на перекладине**\n"
-        "   3 подхода по 20-30 секунд\n"
-        "   Хват: ладони от себя\n\n"
-        "2️⃣ **Подтягивания с паузой**\n"
-        "   3 подхода по 5-8 повторений\n"
-        "   Пауза в верхней точке 2 секунды\n\n"
-        "💡 **Совет дня:** Дыши ровно и концентрируйся на мышцах!"
-    )
-
-    # Кнопка "Я сделал это!"
-    keyboard = [[InlineKeyboardButton("✅ Я выполнил тренировку!", callback_data="log_workout")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Случайная мотивация + неизменная программа
+    workout_text = f"{random.choice(MOTIVATION_PHRASES)}\n\n{WORKOUT_PROGRAM_TEXT}"
 
-    await query.edit_message_text(
-        workout_text,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
+    await edit_message(query, context, workout_text, WORKOUT_TODAY_MARKUP, parse_mode='Markdown')
 
 
-async def show_stats(query, chat_id):
+async def show_stats(query, context, chat_id):
     """Показать статистику пользователя"""
-    stats = user_stats[chat_id]
-
-    # Прогресс-бар (просто для красоты)
-    progress = min(stats["workouts_done"] / 10, 1.0)
-    progress_bar = "█" * int(progress * 10) + "░" * (10 - int(progress * 10))
-
-    stats_text = (
-        "📊 **Твоя статистика**\n\n"
-        f"🏋️ Всего тренировок: **{stats['workouts_done']}**\n"
-        f"📈 Прогресс: [{progress_bar}] {int(progress * 100)}%\n"
-        f"⏱️ Общее время виса: **{stats['total_hold_time']}** сек\n"
-        f"🎯 Рекорд виса: **{stats['max_hold_time']}** сек\n"
-        f"🤸 Подтягиваний всего: **{stats['pullups_done']}**\n"
-        f"🔥 Текущая серия: **{stats['current_streak']}** тренировок\n"
-        f"🏆 Достижений: **{len(stats['achievements'])}**\n"
-    )
-
-    if stats["last_workout"]:
-        last = datetime.fromisoformat(stats["last_workout"])
-        now = datetime.now(pytz.timezone(TIMEZONE))
-        days_ago = (now - last).days
-        stats_text += f"📅 Последняя тренировка: **{days_ago}** дн. назад"
+    stats = await get_stats(chat_id)
+
+    # Прогресс-бар (просто для красоты): 10 делений, по одному на тренировку
+    progress = min(stats.workouts_done, 10)
+
+    lines = [
+        "📊 **Твоя статистика**",
+        "",
+        f"🏋️ Всего тренировок: **{stats.workouts_done}**",
+        f"📈 Прогресс: [{PROGRESS_BARS[progress]}] {progress * 10}%",
+        f"⏱️ Общее время виса: **{stats.total_hold_time}** сек",
+        f"🎯 Рекорд виса: **{stats.max_hold_time}** сек",
+        f"🤸 Подтягиваний всего: **{stats.pullups_done}**",
+        f"🔥 Текущая серия: **{stats.current_streak}** тренировок",
+        f"🏆 Достижений: **{len(stats.achievements)}**",
+    ]
 
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if stats.last_workout:
+        days_ago = (datetime.now(TZ) - stats.last_workout).days
+        lines.append(f"📅 Последняя тренировка: **{days_ago}** дн. назад")
 
-    await query.edit_message_text(
-        stats_text,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
+    await edit_message(query, context, "\n".join(lines), BACK_MARKUP, parse_mode='Markdown')
 
 
-async def show_achievements(query, chat_id):
+async def show_achievements(query, context, chat_id):
     """Показать достижения"""
-    stats = user_stats[chat_id]
-    achievements = stats["achievements"]
-
-    text = "🏆 **Твои достижения**\n\n"
+    stats = await get_stats(chat_id)
+    achievements = stats.achievements
 
     if not achievements:
-        text += "Пока нет достижений. Выполни первую тренировку! 🌱"
+        text = "🏆 **Твои достижения**\n\nПока нет достижений. Выполни первую тренировку! 🌱"
     else:
-        for ach in achievements:
-            if ach in ACHIEVEMENTS:
-                a = ACHIEVEMENTS[ach]
-                text += f"{a['emoji']} **{a['name']}** - {a['desc']}\n"
-
-        # Показать недостигнутые (серым)
-        text += "\n🔒 **Еще можно получить:**\n"
-        for ach_id, ach in ACHIEVEMENTS.items():
-            if ach_id not in achievements:
-                text += f"⚪ {ach['name']} - {ach['desc']}\n"
+        earned_lines = [f"{a['emoji']} **{a['name']}** - {a['desc']}"
+                        for a in achievements.values()]
+        # Недостигнутые (серым)
+        locked_lines = [f"⚪ {a['name']} - {a['desc']}" for a in stats.locked.values()]
 
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+        text = "\n".join([
+            "🏆 **Твои достижения**", "",
+            *earned_lines, "",
+            "🔒 **Еще можно получить:**",
+            *locked_lines
+        ])
 
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    await edit_message(query, context, text, BACK_MARKUP, parse_mode='Markdown')
 
 
-async def show_help(query):
+async def show_help(query, context, chat_id):
     """Показать помощь"""
-    help_text = (
-        "❓ **Как пользоваться ботом**\n\n"
-        "🤖 **Команды:**\n"
-        "/start - Главное меню\n"
-        "/workout - Тренировка на сегодня\n"
-        "/stats - Моя статистика\n"
-        "/achievements - Достижения\n"
-        "/fact - Случайный факт\n"
-        "/log - Отметить тренировку\n\n"
-        "📅 Напоминания приходят в ПН, СР, ПТ в 17:00\n\n"
-        "💪 **Совет:** После тренировки отмечай её в боте,\n"
-        "чтобы копились достижения и статистика!"
-    )
-
-    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    await edit_message(query, context, HELP_TEXT, BACK_MARKUP, parse_mode='Markdown')
 
-    await query.edit_message_text(help_text, reply_markup=reply_markup, parse_mode='Markdown')
 
-
-async def send_random_fact(query):
+async def send_random_fact(query, context, chat_id):
     """Отправить случайный факт о предплечьях"""
-    facts = [
-        "Знаешь ли ты, что сила хвата напрямую связана с долголетием? 🧬",
-        "Предплечья состоят из 20 мышц! Это целая мышцефабрика! 🏭",
-        "Рекорд виса на перекладине - 1 час 5 минут! 😱",
-        "Сильные предплечья помогают играть на музыкальных инструментах 🎸",
-        "У альпинистов самые сильные предплечья в мире 🧗",
-        "Каждый день наши руки совершают тысячи хватательных движений ✋",
-        "Мышцы предплечий восстанавливаются быстрее, чем бицепс или трицепс ⚡",
-        "Сильный хват привлекает противоположный пол (научно доказано!) 💘"
-    ]
-
-    fact = random.choice(facts)
-
-    keyboard = [
-        [
-            InlineKeyboardButton("🎲 Еще факт", callback_data="random_fact"),
-            InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    fact = random.choice(FACTS)
 
-    await query.edit_message_text(f"🧠 **Факт дня:**\n\n{fact}",
-                                  reply_markup=reply_markup,
-                                  parse_mode='Markdown')
+    await edit_message(query, context, f"🧠 **Факт дня:**\n\n{fact}", FACT_MARKUP,
+                       parse_mode='Markdown')
 
 
 async def ask_workout_details(query, context, chat_id):
     """Спросить детали тренировки"""
-    keyboard = [
-        [
-            InlineKeyboardButton("20-30 сек", callback_data="log_hold_25"),
-            InlineKeyboardButton("30-40 сек", callback_data="log_hold_35"),
-            InlineKeyboardButton("40+ сек", callback_data="log_hold_45")
-        ],
-        [
-            InlineKeyboardButton("5-6 подтягиваний", callback_data="log_pull_5"),
-            InlineKeyboardButton("7-8 подтягиваний", callback_data="log_pull_7"),
-            InlineKeyboardButton("9+ подтягиваний", callback_data="log_pull_9")
-        ],
-        [
-            InlineKeyboardButton("✅ Отметить без деталей", callback_data="log_simple"),
-            InlineKeyboardButton("🔙 Отмена", callback_data="back_to_menu")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
+    await edit_message(
+        query, context,
         "📝 **Отметить тренировку**\n\n"
         "Выбери свои результаты сегодня:",
-        reply_markup=reply_markup,
+        LOG_WORKOUT_MARKUP,
         parse_mode='Markdown'
     )
 
 
 async def process_workout_log(query, context, chat_id, callback_data):
     """Обработка отметки о тренировке"""
-    stats = user_stats[chat_id]
-
-    # Парсим данные
-    hold_time = 25  # среднее по умолчанию
-    pullups = 6  # среднее по умолчанию
-
-    if callback_data == "log_hold_25":
-        hold_time = 25
-    elif callback_data == "log_hold_35":
-        hold_time = 35
-    elif callback_data == "log_hold_45":
-        hold_time = 45
-    elif callback_data == "log_pull_5":
-        pullups = 5
-    elif callback_data == "log_pull_7":
-        pullups = 7
-    elif callback_data == "log_pull_9":
-        pullups = 9
-    elif callback_data == "log_simple":
-        hold_time = 25
-        pullups = 6
-
-    # Обновляем статистику
-    stats["workouts_done"] += 1
-    stats["total_hold_time"] += hold_time * 3  # 3 подхода
-    stats["max_hold_time"] = max(stats["max_hold_time"], hold_time)
-    stats["pullups_done"] += pullups * 3  # 3 подхода
-    stats["last_workout"] = datetime.now(pytz.timezone(TIMEZONE)).isoformat()
-
-    # Обновляем серию
-    if stats["last_workout"]:
-        last = datetime.fromisoformat(stats["last_workout"])
-        now = datetime.now(pytz.timezone(TIMEZONE))
-        if (now - last).days <= 2:  # Если прошло не больше 2 дней
-            stats["current_streak"] += 1
+    stats = await get_stats(chat_id)
+
+    hold_time, pullups = WORKOUT_LOG_VALUES[callback_data]
+
+    # Обновляем статистику. До save_stats здесь нет ни одного await, поэтому
+    # при параллельной обработке апдейтов изменение не перемешается с другим,
+    # а строка для базы собирается в save_stats тоже до первого await
+    stats.workouts_done += 1
+    stats.total_hold_time += hold_time * 3  # 3 подхода
+    stats.max_hold_time = max(stats.max_hold_time, hold_time)
+    stats.pullups_done += pullups * 3  # 3 подхода
+
+    # Обновляем серию (сравниваем с предыдущей тренировкой, а не с текущей)
+    now = datetime.now(TZ)
+    prev_last = stats.last_workout
+    stats.last_workout = now
+
+    if prev_last:
+        if (now - prev_last).days <= 2:  # Если прошло не больше 2 дней
+            stats.current_streak += 1
         else:
-            stats["current_streak"] = 1
+            stats.current_streak = 1
     else:
-        stats["current_streak"] = 1
+        stats.current_streak = 1
+
+    # Запоминаем значения до первого await: после него stats может изменить
+    # параллельный апдейт того же пользователя
+    workouts_done = stats.workouts_done
+    current_streak = stats.current_streak
 
     # Проверяем достижения
-    new_achievements = check_achievements(chat_id, {"hold": hold_time, "pullups": pullups})
+    new_achievements = check_achievements(stats, {"hold": hold_time, "pullups": pullups})
+    await save_stats(chat_id, stats)
 
     # Формируем ответ
     comment = random.choice(WORKOUT_COMMENTS)
@@ -494,165 +799,123 @@ async def process_workout_log(query, context, chat_id, callback_data):
 
     # Показываем обновленную статистику
     response += f"\n📊 **Текущая статистика:**\n"
-    response += f"Всего тренировок: {stats['workouts_done']}\n"
-    response += f"Серия: {stats['current_streak']} 🔥"
+    response += f"Всего тренировок: {workouts_done}\n"
+    response += f"Серия: {current_streak} 🔥"
 
-    keyboard = [[InlineKeyboardButton("🔙 В меню", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
-        response,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
+    await edit_message(query, context, response, TO_MENU_MARKUP, parse_mode='Markdown')
 
     # Логируем
     if sheets_logger:
+        profile = user_chats.get(chat_id)
         sheets_logger.log_event(
             event_type="WORKOUT_COMPLETED",
             chat_id=chat_id,
-            username=user_chats.get(chat_id, {}).get("username"),
-            message=f"Тренировка #{stats['workouts_done']}",
+            username=profile["username"] if profile else None,
+            message=f"Тренировка #{workouts_done}",
             additional_data=f"hold:{hold_time},pullups:{pullups}"
         )
 
 
-async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def back_to_menu(query, context, chat_id):
     """Вернуться в главное меню"""
-    query = update.callback_query
-    await query.answer()
-
-    chat_id = update.effective_chat.id
-    first_name = user_chats.get(chat_id, {}).get("first_name", "друг")
-
-    keyboard = [
-        [
-            InlineKeyboardButton("📋 Сегодняшняя тренировка", callback_data="workout_today"),
-            InlineKeyboardButton("📊 Моя статистика", callback_data="stats")
-        ],
-        [
-            InlineKeyboardButton("🏆 Достижения", callback_data="achievements"),
-            InlineKeyboardButton("❓ Помощь", callback_data="help")
-        ],
-        [
-            InlineKeyboardButton("🎲 Случайный факт", callback_data="random_fact"),
-            InlineKeyboardButton("📝 Отметить тренировку", callback_data="log_workout")
-        ]
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    profile = user_chats.get(chat_id)
+    first_name = profile["first_name"] if profile else "друг"
 
-    await query.edit_message_text(
+    await edit_message(
+        query, context,
         f"🌟 Главное меню, {first_name}! 🌟\n\nЧто хочешь сделать?",
-        reply_markup=reply_markup
+        MAIN_MENU_MARKUP
     )
 
 
 async def workout_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /workout"""
-    motivation = random.choice(MOTIVATION_PHRASES)
-
-    workout_text = (
-        f"{motivation}\n\n"
-        "📋 **Сегодняшняя программа:**\n\n"
-        "1️⃣ **Вис на перекладине**\n"
-        "   3 подхода по 20-30 секунд\n\n"
-        "2️⃣ **Подтягивания с паузой**\n"
-        "   3 подхода по 5-8 повторений\n\n"
-        "💪 У тебя получится!"
-    )
+    workout_text = f"{random.choice(MOTIVATION_PHRASES)}\n\n{WORKOUT_COMMAND_TEXT}"
 
     await update.message.reply_text(workout_text, parse_mode='Markdown')
 
 
 async def fact_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /fact"""
-    facts = [
-        "Знаешь ли ты, что сила хвата напрямую связана с долголетием? 🧬",
-        "Предплечья состоят из 20 мышц! Это целая мышцефабрика! 🏭",
-        "Рекорд виса на перекладине - 1 час 5 минут! 😱",
-        "Сильные предплечья помогают играть на музыкальных инструментах 🎸"
-    ]
-
-    await update.message.reply_text(f"🧠 {random.choice(facts)}")
+    await update.message.reply_text(f"🧠 {random.choice(FACTS)}")
+
+
+# Обработчики кнопок по callback_data (кроме кнопок отметки тренировки)
+CALLBACK_HANDLERS = {
+    "workout_today": show_todays_workout,
+    "stats": show_stats,
+    "achievements": show_achievements,
+    "help": show_help,
+    "random_fact": send_random_fact,
+    "log_workout": ask_workout_details,
+    "back_to_menu": back_to_menu,
+}
 
 
-# --- ОСТАЛЬНЫЕ ФУНКЦИИ (send_reminder, schedule_reminders_for_user, error_handler, main) ---
+# --- ОСТАЛЬНЫЕ ФУНКЦИИ (напоминания, error_handler, main) ---
 # ... (оставляем как в предыдущей версии)
 
-async def send_reminder(context: ContextTypes.DEFAULT_TYPE):
-    """Отправка напоминания с кнопками"""
-    job = context.job
-    chat_id = job.chat_id
-
-    if chat_id not in user_chats:
-        job.schedule_removal()
-        return
-
-    motivation = random.choice(MOTIVATION_PHRASES)
-
-    keyboard = [
-        [InlineKeyboardButton("✅ Отметить тренировку", callback_data="log_workout")],
-        [InlineKeyboardButton("📋 Показать тренировку", callback_data="workout_today")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    reminder_text = (
-        f"⏰ **Время тренировки!**\n\n"
-        f"{motivation}\n\n"
-        f"Не забывай про предплечья! 💪"
-    )
-
+async def remind_chat(bot, chat_id: int, profile: Dict[str, Any], reminder_text: str):
+    """Отправка напоминания с кнопками в один чат"""
     try:
-        await context.bot.send_message(
+        await bot.send_message(
             chat_id=chat_id,
             text=reminder_text,
-            reply_markup=reply_markup,
+            reply_markup=REMINDER_MARKUP,
             parse_mode='Markdown'
         )
-        logger.info(f"✅ Напоминание отправлено в чат {chat_id}")
+        logger.info("✅ Напоминание отправлено в чат %s", chat_id)
 
         if sheets_logger:
             sheets_logger.log_event(
                 event_type="REMINDER_SENT",
                 chat_id=chat_id,
-                username=user_chats[chat_id].get("username")
+                username=profile["username"]
             )
     except Exception as e:
-        logger.error(f"❌ Ошибка отправки: {e}")
+        logger.error("❌ Ошибка отправки в чат %s: %s", chat_id, e)
+
+
+async def broadcast_reminder(context: ContextTypes.DEFAULT_TYPE):
+    """Рассылка напоминания всем зарегистрированным пользователям"""
+    # Текст собирается один раз на всю рассылку
+    reminder_text = (
+        f"⏰ **Время тренировки!**\n\n"
+        f"{random.choice(MOTIVATION_PHRASES)}\n\n"
+        f"Не забывай про предплечья! 💪"
+    )
+
+    # Копируем: во время рассылки могут прийти новые /start
+    chats = list(user_chats.items())
+    await asyncio.gather(*(remind_chat(context.bot, chat_id, profile, reminder_text)
+                           for chat_id, profile in chats))
+    logger.info("✅ Рассылка напоминаний завершена (%d чатов)", len(chats))
 
 
-async def schedule_reminders_for_user(application: Application, chat_id: int):
-    """Настройка расписания"""
+def schedule_reminders(application: Application):
+    """Настройка общего расписания напоминаний для всех пользователей"""
     if not application.job_queue:
-        logger.error(f"❌ job_queue не инициализирован для чата {chat_id}")
+        logger.error("❌ job_queue не инициализирован, напоминания не запланированы")
         return
 
-    # Удаляем старые задачи
-    current_jobs = application.job_queue.jobs()
-    for job in current_jobs:
-        if job.chat_id == chat_id and job.name == "forearm_reminder":
-            job.schedule_removal()
-
-    # Дни недели: ПН=0, СР=2, ПТ=4
-    target_days = [0, 2, 4]
-    reminder_time = time(hour=17, minute=0, tzinfo=pytz.timezone(TIMEZONE))
-
-    for day in target_days:
-        application.job_queue.run_daily(
-            send_reminder,
-            time=reminder_time,
-            days=(day,),
-            chat_id=chat_id,
-            name="forearm_reminder"
-        )
+    # Повторный вызов не должен плодить дубли рассылки
+    if application.job_queue.get_jobs_by_name(REMINDER_JOB_NAME):
+        return
 
-    logger.info(f"✅ Запланированы напоминания для чата {chat_id}")
+    # Одна задача на все дни недели: run_daily принимает кортеж дней (ВС=0, см. TARGET_DAYS)
+    application.job_queue.run_daily(
+        broadcast_reminder,
+        time=REMINDER_TIME,
+        days=TARGET_DAYS,
+        name=REMINDER_JOB_NAME
+    )
+
+    logger.info("✅ Запланированы напоминания")
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
-    logger.error(f"Ошибка: {context.error}")
+    logger.error("Ошибка: %s", context.error)
 
     if sheets_logger and update and update.effective_chat:
         sheets_logger.log_event(
@@ -662,6 +925,19 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+async def post_init(application: Application):
+    """Запуск фоновых задач после инициализации приложения"""
+    if sheets_logger:
+        sheets_logger.start_flusher()
+
+
+async def post_shutdown(application: Application):
+    """Дозапись логов и базы перед остановкой бота"""
+    if sheets_logger:
+        await sheets_logger.stop_flusher()
+    db_executor.shutdown(wait=True)
+
+
 def main():
     """Запуск бота"""
     if not BOT_TOKEN:
@@ -672,7 +948,10 @@ def main():
     application = (
         Application.builder()
         .token(BOT_TOKEN)
-        .job_queue()
+        .rate_limiter(AIORateLimiter())  # рассылка не упрется в лимиты Telegram
+        .concurrent_updates(CONCURRENT_UPDATES)  # апдейты разных пользователей не ждут друг друга
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
@@ -687,6 +966,10 @@ def main():
     # Добавляем обработчик ошибок
     application.add_error_handler(error_handler)
 
+    # Одна общая рассылка вместо отдельных задач на каждого пользователя
+    load_users()
+    schedule_reminders(application)
+
     # Логируем запуск
     if sheets_logger:
         sheets_logger.log_event(